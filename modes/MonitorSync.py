@@ -1,48 +1,90 @@
-from PIL import Image
+import numpy as np
 import time
 import dxcam
+from functools import lru_cache
 
 from utils import SendData
 
 ss = dxcam.create()
 
+FPS = 40
+HEARTBEAT = 0.5 # seconds, unchanged colors are sent again this often in case a packet got lost
+
+@lru_cache(maxsize=4)
+def sample_points(width, height, channels):
+    # Centers of the screen regions in LED order: top row right to left, left middle,
+    # bottom row left to right, right middle
+    top, bottom = int(height / 4 * 2), int(height / 4 * 3)
+    columns = [(int(width/4 * x), int(width/4 * (x+1))) for x in range(4)]
+    ys, xs = [], []
+    for x0, x1 in reversed(columns):
+        ys.append(int(top/2))
+        xs.append(x0 + int((x1 - x0)/2))
+    ys.append(top + int((bottom - top)/2))
+    xs.append(int(int(width/4)/2))
+    for x0, x1 in columns:
+        ys.append(bottom + int((height - bottom)/2))
+        xs.append(x0 + int((x1 - x0)/2))
+    ys.append(top + int((height - bottom)/2))
+    xs.append(int(width/4 * 3) + int((columns[3][1] - columns[3][0])/2))
+    ys, xs = np.array(ys), np.array(xs)
+    # Offsets of every sampled channel in the flattened frame, so np.take can gather straight into a buffer
+    flat = ((ys * width + xs)[:, None] * channels + np.arange(3)).ravel()
+    return ys, xs, flat
+
 def start():
     SendData.send_razer_on_off(True)
+    # Two frame buffers that are swapped after every send, so sampling never allocates
+    colors = np.zeros((10, 3), np.uint8)
+    previous_colors = np.zeros_like(colors)
+    difference = np.zeros(colors.shape, np.int16)
+    frame_buffer = bytearray(len(colors) * 3 + 7)
+    sent = False
+    last_send = 0
+    last_warning = 0
+    period = 1 / FPS
+    next_frame = time.monotonic()
     while True:
-
-        colors = []
+        # Sleep until the next frame is due, so the loop runs at FPS no matter how long a frame took
+        next_frame += period
+        delay = next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_frame = time.monotonic()
 
         try:
             screen = ss.grab()
             if screen is None:
+                # dxcam only returns a frame when the screen changed, the last colors are still current
+                if sent and time.monotonic() - last_send >= HEARTBEAT:
+                    last_send = time.monotonic()
+                    SendData.send_razer_data(SendData.convert_colors(previous_colors, frame_buffer))
                 continue
 
-
-            screen = Image.fromarray(screen)
-            width, height = screen.size
+            height, width = screen.shape[:2]
         except OSError:
-            print("Warning: Screenshot failed, trying again...")
+            # A failing capture fails every frame, only report it once a second
+            if time.monotonic() - last_warning >= 1:
+                last_warning = time.monotonic()
+                print("Warning: Screenshot failed, trying again...")
             continue
 
         # TODO combine old and new colors and then add a smooth transition effect
         # TODO possibly add processes to speed this up
 
-        top, bottom = int(height / 4 * 2), int(height / 4 * 3)
-
-        for x in range(4):
-            img = screen.crop((int(width/4 * x), 0, int(width/4 * (x+1)), top))
-            point = (int(img.size[0]/2), int(img.size[1]/2))
-            colors.append(img.getpixel(point))
-        colors.reverse()
-        img = screen.crop((0, top, int(width/4), bottom))
-        point = (int(img.size[0]/2), int(img.size[1]/2))
-        colors.append(img.getpixel(point))
-        for x in range(4):
-            img = screen.crop((int(width/4 * x), bottom, int(width/4 * (x+1)), height))
-            point = (int(img.size[0]/2), int(img.size[1]/2))
-            colors.append(img.getpixel(point))
-        img = screen.crop((int((width/4 * 3)), top, width, bottom))
-        colors.append(img.getpixel(point))
-        time.sleep(0.025) # Added to not kill peoples CPUs
-
-        SendData.send_razer_data(SendData.convert_colors(colors))
\ No newline at end of file
+        ys, xs, flat = sample_points(width, height, screen.shape[2])
+        if screen.flags.c_contiguous:
+            np.take(screen, flat, out=colors.reshape(-1), mode="clip")
+        else:
+            colors[...] = screen[ys, xs, :3]
+
+        # A difference of a couple of steps per channel is invisible on the LEDs, only send real changes
+        if sent:
+            np.subtract(colors, previous_colors, out=difference, dtype=np.int16)
+            if np.abs(difference, out=difference).max() <= 2 and time.monotonic() - last_send < HEARTBEAT:
+                continue
+        sent = True
+        last_send = time.monotonic()
+        SendData.send_razer_data(SendData.convert_colors(colors, frame_buffer))
+        colors, previous_colors = previous_colors, colors
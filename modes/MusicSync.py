@@ -1,5 +1,6 @@
 import soundcard as sc
 import numpy as np
+import time
 from utils import SendData
 
 # Set the audio parameters
@@ -7,13 +8,21 @@ duration = 0.01  # seconds
 sample_rate = 48000  # You can adjust this based on your requirements
 
 LED_COUNT = 20
-colors = [[0, 0, 0]] * LED_COUNT
+HEARTBEAT = 0.5 # seconds, an unchanged frame is sent again this often in case a packet got lost
+# Ring buffer of the last LED_COUNT colors, every color is stored twice so the
+# current window is always one contiguous slice colors[head:head + LED_COUNT]
+colors = np.zeros((LED_COUNT * 2, 3), np.uint8)
+head = 0
+frame_buffer = bytearray(LED_COUNT * 3 + 7)
+last_frame = None
+last_send = 0
 
 def start():
     SendData.send_razer_on_off(True)
-    while True:
-        with sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(
-                samplerate=sample_rate) as mic:
+    # Open the loopback recorder once, setting it up again for every chunk is expensive
+    with sc.get_microphone(id=str(sc.default_speaker().name), include_loopback=True).recorder(
+            samplerate=sample_rate) as mic:
+        while True:
             #Try and except due to a soundcard error when no audio is playing
             try:
                 data = mic.record(numframes=duration * sample_rate)
@@ -25,18 +34,23 @@ def start():
 def get_amplitude(mic_data = None):
     if mic_data is None:
         return 0
-    amplitude = np.max(np.abs(mic_data))
+    # Peak of the absolute signal without building an abs() copy of the whole chunk
+    amplitude = max(float(mic_data.max()), -float(mic_data.min()))
     if amplitude > 1:
         amplitude = 1
     return amplitude
 
 def wave_color(amplitude):
-    match amplitude:
-        case amplitude if amplitude < 0.04:
-            colors.append([int(amplitude * 255), 0, 0])
-        case amplitude if amplitude > 0.04 and amplitude < 0.08:
-            colors.append([0, int(amplitude * 255), 0])
-        case _:
-            colors.append([0, 0, int(amplitude * 255)])
-    colors.pop(0)
-    SendData.send_razer_data(SendData.convert_colors(colors))
\ No newline at end of file
+    global head, last_frame, last_send
+    # Quiet sounds are red, medium ones green and loud ones blue
+    color = [0, 0, 0]
+    color[int(amplitude >= 0.04) + int(amplitude >= 0.08)] = int(amplitude * 255)
+    colors[head] = colors[head + LED_COUNT] = color
+    head = (head + 1) % LED_COUNT
+    # During silence every chunk produces the same frame again, no need to send it
+    frame = SendData.convert_colors(colors[head:head + LED_COUNT], frame_buffer)
+    if frame == last_frame and time.monotonic() - last_send < HEARTBEAT:
+        return
+    last_frame = frame
+    last_send = time.monotonic()
+    SendData.send_razer_data(frame)
\ No newline at end of file
@@ -1,4 +1,3 @@
-import json
 import time
 import colorama
 
@@ -6,12 +5,11 @@ from utils import GetDevices
 
 def get_device_data():
     try:
-        with open("Settings.json", "r") as f:
-            data = json.load(f)
+        data = GetDevices.readJSON()
 
-        if time.time() - data.get("time", 0) > 86400:
-            print("Device data is older than 24 hours, requesting new data...")
-            data = GetDevices.start()
+        if time.time() - data.get("time", 0) > 604800:
+            print("Device data is older than 7 days, refreshing it...")
+            data = GetDevices.refresh(data)
         if len(data["devices"]) > 1:
             print(f"{colorama.Fore.LIGHTYELLOW_EX}Please select a device:\n{colorama.Fore.YELLOW}" +
                 "\n".join([f"{i + 1}) {device['Device_IP']} ({device['Model']})" for i, device in enumerate(data["devices"])]))
@@ -20,6 +18,6 @@ def get_device_data():
             GetDevices.writeJSON(data)
         return data
     except FileNotFoundError:
-        print("Settings.json not found, requesting new data...")
+        print(f"{GetDevices.SETTINGS_PATH} not found, requesting new data...")
         data = GetDevices.start()
         return data
@@ -1,72 +1,176 @@
+import os
+import hashlib
 import socket
+import selectors
 import json
 import time
 import colorama
 import sys
+import atexit
+from functools import lru_cache
+
+# Local
+from utils import SocketBatch
 
 multicast = "239.255.255.250"
 
 port = 4001
 listen_port = 4002
 
-def start():
-    requestScan()
-    print(f"{colorama.Fore.YELLOW}Trying to find device...")
-    data = listen()
-    print(f"{colorama.Fore.GREEN}Device found!")
-    settings = parseMessages(data)
-    writeJSON(settings)
-    return(settings)
+SETTINGS_PATH = "Settings.json"
 
-def requestScan():
-    data = {"msg":{"cmd":"scan","data":{"account_topic":"reserve"}}}
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(bytes(json.dumps(data), "utf-8"), (multicast, port))
-    return
+_SCAN_PAYLOAD = bytes(json.dumps({"msg":{"cmd":"scan","data":{"account_topic":"reserve"}}}), "utf-8")
+_SCAN_ADDR = (multicast, port)
 
-def listen():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.settimeout(10)
-    sock.bind(('', listen_port))
-    messages = []
-    try:
-        while True:
-            message, address = sock.recvfrom(1024)
-            print(f"{colorama.Fore.LIGHTGREEN_EX}Received message from: ", address)
-            messages.append(message)
-    except socket.timeout:
-        if len(messages) == 0:
-            print(f"{colorama.Fore.RED}Error: No device found!")
-            sys.exit(1)
-    return messages
+_cache = {"mtime": 0, "data": None, "digest": None}
+_sock = None
+_selector = selectors.DefaultSelector()
 
-def parseMessages(messages):
+def start():
     try:
-        with open("Settings.json", "r") as f:
-            settings = json.load(f)
+        settings = readJSON()
     except FileNotFoundError:
         settings = {
             "time": time.time(),
             "devices": [],
             "selectedDevice": 0
         }
-    for deviceJson in messages:
-        device = json.loads(deviceJson)
-        existingDevice = next((x for x in settings["devices"] if x["MAC"] == device["msg"]["data"]["device"]), None)
-        if existingDevice is None:
-            data = {
-                "MAC": device["msg"]["data"]["device"],
-                "Model": device["msg"]["data"]["sku"],
-                "Device_IP": device["msg"]["data"]["ip"],
-                "Device_Port": 4003
-            }
-            settings["devices"].append(data)
-        else:
-            existingDevice["Device_IP"] = device["msg"]["data"]["ip"]
-    settings["time"] = time.time()
+    sock = getSocket()
+    SocketBatch.recvmmsg(sock) # Drop leftover replies from earlier scans
+    requestScan(sock)
+    print(f"{colorama.Fore.YELLOW}Trying to find device...")
+    found = listen(sock, settings)
+    if not found:
+        print(f"{colorama.Fore.RED}Error: No device found!")
+        sys.exit(1)
+    print(f"{colorama.Fore.GREEN}Found {len(found)} device(s)!")
+    writeJSON(settings)
+    return(settings)
+
+def refresh(settings, timeout=1):
+    # Ask the known devices directly, only when one of them stays silent is a full multicast scan needed
+    if not settings["devices"]:
+        return start()
+    sock = getSocket()
+    SocketBatch.recvmmsg(sock)
+    SocketBatch.sendmmsg(sock, [(_SCAN_PAYLOAD, (x["Device_IP"], port)) for x in settings["devices"]])
+    known = {x["MAC"] for x in settings["devices"]}
+    if not known <= listen(sock, settings, timeout, expected=len(known)):
+        print("Not every device answered, requesting new data...")
+        return start()
+    writeJSON(settings)
     return settings
 
+def getSocket():
+    # Discovery and probes share one socket bound to the listen port, created on first use
+    global _sock
+    if _sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        # No address reuse, another socket on the listen port would silently take part of the device replies.
+        # Windows lets other sockets share the port unless it is claimed exclusively
+        if hasattr(socket, "SO_EXCLUSIVEADDRUSE"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        sock.bind(('', listen_port))
+        sock.setblocking(False)
+        _selector.register(sock, selectors.EVENT_READ)
+        atexit.register(sock.close)
+        _sock = sock
+    return _sock
+
+@lru_cache(maxsize=1)
+def getInterfaces():
+    # Resolving the host name can wait on DNS, so it is only done once per run
+    try:
+        addresses = {x[4][0] for x in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)}
+    except socket.gaierror:
+        return ()
+    return tuple(x for x in addresses if not x.startswith("127."))
+
+def requestScan(sock):
+    # Send the scan out of every local interface at once, all replies land on the same listen socket
+    sent = False
+    for interface in getInterfaces():
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+            sock.sendto(_SCAN_PAYLOAD, _SCAN_ADDR)
+            sent = True
+        except OSError:
+            continue
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton("0.0.0.0"))
+    if not sent:
+        # No usable interface addresses, let the system pick the default one
+        sock.sendto(_SCAN_PAYLOAD, _SCAN_ADDR)
+    return
+
+def listen(sock, settings, timeout=10, quiet=0.5, expected=None):
+    # Replies are merged into settings as they arrive and listening stops once
+    # devices have answered and the network stayed quiet for a moment
+    devicesByMac = {x["MAC"]: x for x in settings["devices"]}
+    deadline = time.monotonic() + timeout
+    found = set()
+    while expected is None or len(found) < expected:
+        remaining = deadline - time.monotonic()
+        if found:
+            remaining = min(remaining, quiet)
+        if remaining <= 0 or not _selector.select(remaining):
+            break
+        for message, address in SocketBatch.recvmmsg(sock):
+            mac = parseMessage(settings, devicesByMac, message)
+            if mac is not None:
+                found.add(mac)
+    if found:
+        settings["time"] = time.time()
+    return found
+
+def parseMessage(settings, devicesByMac, deviceJson):
+    try:
+        message = json.loads(deviceJson)["msg"]
+        if message["cmd"] != "scan":
+            return None
+        device = message["data"]
+        mac, model, ip = device["device"], device["sku"], device["ip"]
+    except (ValueError, KeyError, TypeError):
+        # Anything on the listen port that is not a device reply is ignored
+        return None
+    existingDevice = devicesByMac.get(mac)
+    if existingDevice is None:
+        data = {
+            "MAC": mac,
+            "Model": model,
+            "Device_IP": ip,
+            "Device_Port": 4003
+        }
+        settings["devices"].append(data)
+        devicesByMac[data["MAC"]] = data
+    else:
+        existingDevice["Device_IP"] = ip
+    return mac
+
+def readJSON():
+    # Only parse the file again when it changed on disk since the last read
+    mtime = os.stat(SETTINGS_PATH).st_mtime
+    if _cache["data"] is None or _cache["mtime"] != mtime:
+        with open(SETTINGS_PATH, "rb") as f:
+            data = f.read()
+        _cache.update(mtime=mtime, data=json.loads(data), digest=hashlib.blake2b(data).digest())
+    return _cache["data"]
+
 def writeJSON(settings):
-    with open("settings.json", "w") as f:
-        json.dump(settings, f)
-    print(f"{colorama.Fore.LIGHTGREEN_EX}Data written to Settings.json")
+    data = json.dumps(settings).encode()
+    digest = hashlib.blake2b(data).digest()
+    if digest == _cache["digest"]:
+        return
+    # Write to a temporary file first so a crash never leaves a half written settings file
+    try:
+        with open(SETTINGS_PATH + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(SETTINGS_PATH + ".tmp", SETTINGS_PATH)
+    except OSError:
+        try:
+            os.remove(SETTINGS_PATH + ".tmp")
+        except OSError:
+            pass
+        raise
+    _cache.update(mtime=os.stat(SETTINGS_PATH).st_mtime, data=settings, digest=digest)
+    print(f"{colorama.Fore.LIGHTGREEN_EX}Data written to {SETTINGS_PATH}")
@@ -1,56 +1,125 @@
 import socket
 import base64
 import json
+import queue
+import select
+import atexit
+import time
+import numpy as np
+from threading import Thread
 
 # Local
-from utils import GetData
+from utils import GetData, SocketBatch
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+# A small send buffer and non-blocking sends keep latency bounded, frames that do not fit are dropped
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16 * 1024)
 settings = GetData.get_device_data()
 device = settings["devices"][settings["selectedDevice"]]
+address = (device.get('Device_IP'), device.get('Device_Port', 4003))
+sock.connect(address)
+sock.setblocking(False)
+_send_queue = queue.SimpleQueue()
 
+_TURN_ON = bytes(json.dumps({"msg": {"cmd": "turn", "data": {"value": 1}}}), "utf-8")
+_TURN_OFF = bytes(json.dumps({"msg": {"cmd": "turn", "data": {"value": 0}}}), "utf-8")
+_RAZER_ON = bytes(json.dumps({"msg": {"cmd": "razer", "data": {"pt": "uwABsQEK"}}}), "utf-8")
+_RAZER_OFF = bytes(json.dumps({"msg": {"cmd": "razer", "data": {"pt": "uwABsgEJ"}}}), "utf-8")
+_RAZER_PREFIX = b'{"msg":{"cmd":"razer","data":{"pt":"'
+_RAZER_SUFFIX = b'"}}}'
 
-def convert_colors(colors: list) -> str:
-    razer_header = [0xBB, 0x00, 0x0E, 0xB0, 0x01, len(colors)]
-    for color in colors:
-        razer_header.extend(color)
-    checksum = 0
-    for byte in razer_header:
-        checksum ^= byte
-    razer_header.append(checksum)
-    base64_header = base64.b64encode(bytearray(razer_header))
-    return base64_header.decode("utf-8")
-
-
-def send_razer_data(data: base64) -> None:
-    data = {"msg": {
-            "cmd": "razer",
-            "data": {
-                "pt": data}
-        }
-    }
-    send_data(data)
+
+def convert_colors(colors, out: bytearray = None) -> bytes:
+    # out can be a bytearray kept by the caller, it is reused when it already has the frame's size
+    size = len(colors) * 3 + 7
+    if out is None or len(out) != size:
+        out = bytearray(size)
+    frame = np.frombuffer(out, np.uint8)
+    frame[:6] = (0xBB, 0x00, 0x0E, 0xB0, 0x01, len(colors))
+    frame[6:-1].reshape(-1, 3)[...] = colors
+    frame[-1] = np.bitwise_xor.reduce(frame[:-1])
+    return base64.b64encode(out)
+
+
+def send_razer_data(data: bytes) -> None:
+    send_payload(b"".join((_RAZER_PREFIX, data, _RAZER_SUFFIX)), droppable=True)
     return
 
 
 def send_on_off(on_off: bool = None) -> None:
-    send_data({"msg":
-                   {"cmd": "turn",
-                    "data":
-                        {"value": 1 if on_off else 0}
-                    }
-               })
+    send_payload(_TURN_ON if on_off else _TURN_OFF)
 
 
 def send_razer_on_off(on_off: bool = None) -> None:
-    send_data({"msg":
-                   {"cmd": "razer",
-                    "data":
-                        {"pt": "uwABsQEK" if on_off else "uwABsgEJ"}
-                    }
-               })
+    send_payload(_RAZER_ON if on_off else _RAZER_OFF)
 
 
 def send_data(data) -> json:
-    sock.sendto(bytes(json.dumps(data), "utf-8"), (device.get('Device_IP'), device.get('Device_Port', 4003)))
+    send_payload(json.dumps(data, separators=(",", ":")).encode())
     return
+
+
+def send_payload(payload: bytes, droppable: bool = False) -> None:
+    # Sending happens on the sender thread so the sync loops never wait on the socket.
+    # Droppable payloads are colour frames, which may be lost when the send buffer is full
+    _send_queue.put_nowait((payload, droppable))
+
+
+def _send_loop() -> None:
+    running = True
+    last_warning = 0
+    while running:
+        messages = []
+        controls = []
+        item = _send_queue.get()
+        while True:
+            if item is None:
+                running = False
+                break
+            payload, droppable = item
+            messages.append((payload, None))
+            if not droppable:
+                controls.append(payload)
+            if len(messages) >= SocketBatch.MAX_BATCH:
+                break
+            try:
+                item = _send_queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            SocketBatch.sendmmsg(sock, messages)
+        except BlockingIOError:
+            # The send buffer is full, colour frames are dropped since a newer one follows shortly,
+            # but on/off commands are never repeated and have to wait until they fit
+            try:
+                for payload in controls:
+                    _send_blocking(payload)
+            except OSError as e:
+                print(f"Warning: Sending data failed ({e})")
+        except OSError as e:
+            if time.monotonic() - last_warning >= 1:
+                last_warning = time.monotonic()
+                print(f"Warning: Sending data failed ({e})")
+
+
+def _send_blocking(payload: bytes, timeout: float = 1) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            sock.send(payload)
+            return
+        except BlockingIOError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            select.select([], [sock], [], remaining)
+
+
+def _stop_sender() -> None:
+    _send_queue.put_nowait(None)
+    _sender.join(1)
+
+
+_sender = Thread(daemon=True, target=_send_loop, name="SendData")
+_sender.start()
+atexit.register(_stop_sender)
@@ -0,0 +1,130 @@
+import ctypes
+import errno
+import os
+import socket
+import sys
+
+# Linux can hand the kernel a whole batch of datagrams in one sendmmsg/recvmmsg
+# call, every other platform falls back to one sendto/recvfrom per datagram.
+MAX_BATCH = 32
+RECV_BUFSIZE = 1024
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IOVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort),
+                ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_ubyte * 4),
+                ("sin_zero", ctypes.c_ubyte * 8)]
+
+
+_libc = None
+if sys.platform == "linux":
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        _libc.sendmmsg.restype = ctypes.c_int
+        _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        _libc.recvmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        _libc = None
+
+
+# recvmmsg receives into the same preallocated buffers every call
+if _libc is not None:
+    _recv_buffers = ((ctypes.c_char * RECV_BUFSIZE) * MAX_BATCH)()
+    _recv_iovecs = (_IOVec * MAX_BATCH)()
+    _recv_names = (_SockAddrIn * MAX_BATCH)()
+    _recv_headers = (_MMsgHdr * MAX_BATCH)()
+    for _i in range(MAX_BATCH):
+        _recv_iovecs[_i].iov_base = ctypes.addressof(_recv_buffers[_i])
+        _recv_iovecs[_i].iov_len = RECV_BUFSIZE
+        _recv_headers[_i].msg_hdr.msg_iov = ctypes.pointer(_recv_iovecs[_i])
+        _recv_headers[_i].msg_hdr.msg_iovlen = 1
+        _recv_headers[_i].msg_hdr.msg_name = ctypes.addressof(_recv_names[_i])
+
+
+def _sockaddr(address: tuple) -> _SockAddrIn:
+    return _SockAddrIn(socket.AF_INET, socket.htons(address[1]), (ctypes.c_ubyte * 4)(*socket.inet_aton(address[0])))
+
+
+def sendmmsg(sock: socket.socket, messages: list) -> None:
+    # messages is a list of (payload, address) tuples, address may be None on a connected socket
+    if _libc is None:
+        for payload, address in messages:
+            if address is None:
+                sock.send(payload)
+            else:
+                sock.sendto(payload, address)
+        return
+    for start in range(0, len(messages), MAX_BATCH):
+        batch = messages[start:start + MAX_BATCH]
+        count = len(batch)
+        iovecs = (_IOVec * count)()
+        headers = (_MMsgHdr * count)()
+        addresses = {}
+        for i, (payload, address) in enumerate(batch):
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(payload), ctypes.c_void_p)
+            iovecs[i].iov_len = len(payload)
+            header = headers[i].msg_hdr
+            header.msg_iov = ctypes.pointer(iovecs[i])
+            header.msg_iovlen = 1
+            if address is not None:
+                if address not in addresses:
+                    addresses[address] = _sockaddr(address)
+                header.msg_name = ctypes.addressof(addresses[address])
+                header.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        sent = 0
+        while sent < count:
+            result = _libc.sendmmsg(sock.fileno(), ctypes.addressof(headers) + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+            sent += result
+
+
+def recvmmsg(sock: socket.socket) -> list:
+    # Drains the datagrams already queued on a non-blocking socket as (payload, address) tuples
+    messages = []
+    if _libc is None:
+        while True:
+            try:
+                messages.append(sock.recvfrom(RECV_BUFSIZE))
+            except BlockingIOError:
+                return messages
+            except ConnectionResetError:
+                # Windows reports an ICMP port unreachable from an earlier sendto here, it is not a datagram
+                continue
+    while True:
+        for header in _recv_headers:
+            header.msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+        result = _libc.recvmmsg(sock.fileno(), ctypes.addressof(_recv_headers), MAX_BATCH, socket.MSG_DONTWAIT, None)
+        if result < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return messages
+            raise OSError(error, os.strerror(error))
+        for i in range(result):
+            address = (socket.inet_ntoa(bytes(_recv_names[i].sin_addr)), socket.ntohs(_recv_names[i].sin_port))
+            messages.append((ctypes.string_at(_recv_buffers[i], _recv_headers[i].msg_len), address))
+        if result < MAX_BATCH:
+            return messages